@@ -0,0 +1,100 @@
+import threading
+import logging
+import time
+
+from .IOScheduler import IOScheduler, getDevice
+
+logger = logging.getLogger('monitor')
+
+# 各清晰度码率的初始估计（bits/s），录制时会根据实际下载速度修正
+_defaultBitrate = {10000: 10e6, 400: 4e6, 250: 2.5e6, 150: 1.5e6, 80: 0.8e6}
+
+
+class _Active:
+    def __init__(self, room, qn):
+        self.room = room
+        self.qn = qn
+        self.rate = None
+        self.lastBytes = 0
+        self.lastTime = time.monotonic()
+
+
+class AdmissionController:
+    # 在总带宽上限内为各房间选择清晰度，为未开播的高优先级房间预留最低清晰度所需的带宽
+    # 清晰度只在重连（开始录制）时调整，不会为了升降清晰度主动中断录制
+    lock = threading.Lock()
+    bandwidth = 0       # 下行带宽上限（bits/s），0为不限制
+    bitrates = {}       # (roomid, qn) -> 实测码率
+    active = {}         # roomid -> _Active
+    rooms = []
+
+    @classmethod
+    def configure(cls, bandwidth=0):
+        # bandwidth单位为Mbps
+        cls.bandwidth = float(bandwidth) * 1e6
+
+    @classmethod
+    def estimate(cls, roomid, qn):
+        return cls.bitrates.get((roomid, qn)) or _defaultBitrate.get(qn) or max(_defaultBitrate.values())
+
+    @classmethod
+    def register(cls, room):
+        cls.rooms.append(room)
+
+    @classmethod
+    def _minimum(cls, roomid):
+        # 房间最低清晰度的码率估计
+        learned = [rate for (rid, _), rate in cls.bitrates.items() if rid == roomid]
+        return min(learned + [min(_defaultBitrate.values())])
+
+    @classmethod
+    def _committed(cls, room):
+        # 其他录制实际占用的带宽，加上为未开播的高优先级房间预留的带宽
+        total = sum(a.rate or cls.estimate(a.room.id, a.qn)
+                    for a in cls.active.values() if a.room is not room)
+        total += sum(cls._minimum(r.id) for r in cls.rooms
+                     if r is not room and r.id not in cls.active and r.priority > room.priority)
+        return total
+
+    @classmethod
+    def chooseQuality(cls, room, qns):
+        # 在重连（开始录制）时调用，返回应请求的qn
+        qns = sorted(qns, reverse=True)
+        if IOScheduler.underPressure(getDevice(room._tmpfolder)):
+            logger.info(f'{room.code}: disk under pressure, choose lowest quality')
+            return qns[-1]
+        if not cls.bandwidth:
+            return qns[0]
+        with cls.lock:
+            available = cls.bandwidth - cls._committed(room)
+            for qn in qns:
+                if cls.estimate(room.id, qn) <= available:
+                    return qn
+        logger.info(f'{room.code}: bandwidth cap reached, choose lowest quality')
+        return qns[-1]
+
+    @classmethod
+    def admit(cls, room, qn):
+        with cls.lock:
+            cls.active[room.id] = _Active(room, qn)
+
+    @classmethod
+    def release(cls, room):
+        with cls.lock:
+            cls.active.pop(room.id, None)
+
+    @classmethod
+    def sample(cls, room, downloaded):
+        # 由LiveRoom.report定期调用，更新该录制的实测码率
+        with cls.lock:
+            a = cls.active.get(room.id)
+            if a is None:
+                return
+            now = time.monotonic()
+            if now - a.lastTime < 1:
+                return
+            rate = (downloaded-a.lastBytes)*8/(now-a.lastTime)
+            a.rate = rate if a.rate is None else a.rate*0.7 + rate*0.3
+            a.lastBytes, a.lastTime = downloaded, now
+            key = (room.id, a.qn)
+            cls.bitrates[key] = rate if key not in cls.bitrates else cls.bitrates[key]*0.9 + rate*0.1
@@ -0,0 +1,48 @@
+import threading
+
+
+class BufferPool:
+    # 固定大小的接收缓冲区池，限制所有录制同时占用的内存
+    def __init__(self, capacity=16 << 20, buffersize=64 << 10):
+        self.buffersize = buffersize
+        self.count = max(1, capacity // buffersize)
+        self._free = []
+        self._allocated = 0
+        self._cond = threading.Condition()
+
+        self.inUse = 0
+        self.peak = 0
+        self.waits = 0
+
+    def acquire(self, timeout=None):
+        # 池已用尽时阻塞，超时返回None
+        with self._cond:
+            if not self._free and self._allocated >= self.count:
+                self.waits += 1
+                if not self._cond.wait_for(lambda: self._free, timeout):
+                    return None
+            if self._free:
+                buf = self._free.pop()
+            else:
+                buf = bytearray(self.buffersize)
+                self._allocated += 1
+            self.inUse += 1
+            self.peak = max(self.peak, self.inUse)
+            return buf
+
+    def release(self, buf):
+        with self._cond:
+            self._free.append(buf)
+            self.inUse -= 1
+            self._cond.notify()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'buffersize': self.buffersize,
+                'count': self.count,
+                'allocated': self._allocated,
+                'inUse': self.inUse,
+                'peak': self.peak,
+                'waits': self.waits,
+            }
@@ -1,17 +1,19 @@
-from queue import Queue
 import threading
 import logging
 import time
 import os
 
 from .flv_checker import Flv
+from .IOScheduler import IOScheduler, getDevice
+from .TaskScheduler import TaskScheduler
 
 logger = logging.getLogger('postprocess')
 
 class FlvCheckThread(threading.Thread):
-    q = Queue()
+    q = TaskScheduler()
     threads = []
     event=threading.Event()
+    lock = threading.Lock()
 
     def __init__(self):
         super().__init__()
@@ -21,33 +23,61 @@ class FlvCheckThread(threading.Thread):
     def run(self):
         logger.info(f'FlvCheckThread started.')
         while not self.event.is_set():
-            if self.q.empty():
-                self.event.wait(1)
+            task = self.q.get(timeout=1)
+            if task is None:
                 continue
-            temppath, saveto = self.q.get()
-            self.flv = Flv(temppath, saveto)
+            temppath, saveto = task.temppath, task.saveto
+            devices = {getDevice(temppath), getDevice(saveto)}
+            self.flv = Flv(temppath, saveto, throttle=lambda n: IOScheduler.throttle(devices, n))
             try:
                 self.flv.check()
             except Exception as e:
                 logger.info(f'Error occurred while processing {temppath}: {e}')
+                self.q.task_done(task, success=False)
             else:
                 if self.flv.keepRunning:
                     os.remove(temppath)
                     logger.info(f'task finished:{temppath} -> {saveto}')
-                    self.q.task_done()
+                    self.q.task_done(task)
                 else:
                     os.remove(saveto)
-                    self.q.put((temppath, saveto))
+                    self.q.requeue(task)
             self.flv=None
         logger.info(f'FlvCheckThread terminated.')
 
     @classmethod
-    def addTask(cls, temppath, saveto):
-        cls.q.put((temppath, saveto))
+    def setConcurrency(cls, perDisk):
+        # 每个目标磁盘同时处理的任务数
+        cls.q.perDisk = perDisk
+        cls._ensureThreads()
+
+    @classmethod
+    def _ensureThreads(cls):
+        # 按有任务的磁盘数启动足够的线程，使不同磁盘上的任务可以并行处理
+        with cls.lock:
+            if cls.event.is_set():
+                return
+            wanted = sum(min(n, cls.q.perDisk) for n in cls.q.devices().values())
+            alive = [th for th in cls.threads if th.is_alive()]
+            for _ in range(max(wanted, cls.q.perDisk) - len(alive)):
+                cls().start()
+
+    @classmethod
+    def addTask(cls, temppath, saveto, priority=0):
+        cls.q.put(temppath, saveto, priority)
+        cls._ensureThreads()
+        for path, remain in cls.q.eta():
+            if path == temppath:
+                logger.info(f'{os.path.basename(temppath)}: expected to finish in {remain:.0f}s')
+
+    @classmethod
+    def eta(cls):
+        return cls.q.eta()
 
     @classmethod
     def onexit(cls):
         cls.event.set()
+        IOScheduler.onexit()
         for th in cls.threads:
             if th.flv:
                 th.flv.keepRunning = False
@@ -57,5 +87,4 @@ class FlvCheckThread(threading.Thread):
 
     @classmethod
     def getQueue(cls):
-        while not cls.q.empty():
-            yield cls.q.get()
+        yield from cls.q.drain()
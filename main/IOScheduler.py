@@ -0,0 +1,137 @@
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger('postprocess')
+
+
+def getDevice(path):
+    # 返回路径所在的设备号，文件不存在时使用其所在目录
+    while path and not os.path.exists(path):
+        parent = os.path.dirname(path)
+        if parent == path:
+            break
+        path = parent
+    return os.stat(path or '.').st_dev
+
+
+class _DiskStat:
+    def __init__(self, budget):
+        self.budget = budget    # 录制进行中时后处理的读写上限（bytes/s）
+        self.recording = 0      # 正在写入该设备的录制数
+        self.latency = 0.       # 录制写入延迟的滑动平均（秒）
+        self.recordBytes = 0
+        self.postBytes = 0
+        self.pausedTime = 0.
+        self.tokens = budget
+        self.lastRefill = time.monotonic()
+
+
+class IOScheduler:
+    # 根据录制的写入压力限制时间戳校准的读写速度，设备空闲时不做限制
+    lock = threading.Lock()
+    event = threading.Event()
+    disks = {}
+    defaultBudget = 8 << 20
+    budgets = {}
+    highLatency = 0.2
+    maxPause = 60
+
+    @classmethod
+    def configure(cls, budget=8, diskbudget='', latency=0.2):
+        # budget与diskbudget的单位为MB/s，diskbudget格式为 "路径:MB, 路径:MB"
+        cls.defaultBudget = int(float(budget) * (1 << 20))
+        cls.highLatency = float(latency)
+        for item in diskbudget.split(','):
+            path, _, value = item.strip().rpartition(':')
+            if path and value:
+                cls.budgets[getDevice(path)] = int(float(value) * (1 << 20))
+
+    @classmethod
+    def _disk(cls, dev):
+        disk = cls.disks.get(dev)
+        if disk is None:
+            disk = cls.disks[dev] = _DiskStat(
+                cls.budgets.get(dev, cls.defaultBudget))
+        return disk
+
+    @classmethod
+    def recordingStarted(cls, dev):
+        with cls.lock:
+            cls._disk(dev).recording += 1
+
+    @classmethod
+    def recordingStopped(cls, dev):
+        with cls.lock:
+            disk = cls._disk(dev)
+            disk.recording -= 1
+            if not disk.recording:
+                disk.latency = 0.
+
+    @classmethod
+    def recordWrite(cls, dev, nbytes, elapsed):
+        # 由Recorder在每次写入后调用
+        with cls.lock:
+            disk = cls._disk(dev)
+            disk.recordBytes += nbytes
+            disk.latency += (elapsed - disk.latency) * 0.2
+
+    @classmethod
+    def underPressure(cls, dev):
+        disk = cls.disks.get(dev)
+        return bool(disk and disk.recording and disk.latency > cls.highLatency)
+
+    @classmethod
+    def throttle(cls, devs, nbytes):
+        # 由后处理每读写nbytes后调用，必要时阻塞
+        for dev in devs:
+            with cls.lock:
+                disk = cls._disk(dev)
+                disk.postBytes += nbytes
+
+            # 录制写入延迟过高，暂停后处理
+            start = time.monotonic()
+            while cls.underPressure(dev) and not cls.event.is_set() \
+                    and time.monotonic()-start < cls.maxPause:
+                cls.event.wait(0.5)
+            paused = time.monotonic()-start
+            if paused > 0.5:
+                logger.debug(f'postprocess paused for {paused:.1f}s due to recording pressure')
+
+            with cls.lock:
+                disk.pausedTime += paused
+                now = time.monotonic()
+                disk.tokens = min(disk.budget, disk.tokens +
+                                  (now-disk.lastRefill)*disk.budget)
+                disk.lastRefill = now
+                if not disk.recording:
+                    continue
+                disk.tokens -= nbytes
+                wait = -disk.tokens/disk.budget if disk.tokens < 0 else 0
+            if wait:
+                cls.event.wait(wait)
+
+    @classmethod
+    def stats(cls):
+        with cls.lock:
+            return {
+                dev: {
+                    'recording': d.recording,
+                    'latency': d.latency,
+                    'recordBytes': d.recordBytes,
+                    'postBytes': d.postBytes,
+                    'pausedTime': d.pausedTime,
+                    'budget': d.budget,
+                } for dev, d in cls.disks.items()
+            }
+
+    @classmethod
+    def onexit(cls):
+        cls.event.set()
+        for dev, s in cls.stats().items():
+            logger.info(
+                'I/O stats of device {}: recorded {:.1f} MB, postprocessed {:.1f} MB, '
+                'postprocess paused {:.1f}s, write latency {:.3f}s'.format(
+                    dev, s['recordBytes']/(1 << 20), s['postBytes']/(1 << 20),
+                    s['pausedTime'], s['latency']))
@@ -0,0 +1,230 @@
+from http.server import HTTPServer, BaseHTTPRequestHandler
+from socketserver import ThreadingMixIn
+import threading
+import logging
+
+logger = logging.getLogger('recorder')
+
+
+class StreamBuffer:
+    # 单个房间的直播流环形缓冲区，由Recorder写入，所有客户端共享同一份数据
+    def __init__(self, capacity=8 << 20):
+        self.capacity = capacity
+        self._cond = threading.Condition()
+        self._ring = None
+        self._view = None
+        self.generation = 0
+        self.closed = False
+        self._resetState()
+
+    def _resetState(self):
+        self.writePos = 0   # 从流开始计的绝对偏移量
+        self.header = None  # flv头部+script tag+音视频sequence header
+        self._headerParts = []
+        self._nextTag = 0
+        self._parsing = True
+        self.keyframePos = None  # 最近一个关键帧tag的起始位置
+
+    def reset(self):
+        # 新的录制开始，已连接的客户端会被断开
+        with self._cond:
+            if self._ring is None:
+                self._ring = bytearray(self.capacity)
+                self._view = memoryview(self._ring)
+            self.generation += 1
+            self.closed = False
+            self._resetState()
+            self._cond.notify_all()
+
+    def close(self):
+        # 录制结束，释放缓冲区
+        with self._cond:
+            self.closed = True
+            self.generation += 1
+            self._ring = None
+            self._view = None
+            self._cond.notify_all()
+
+    def write(self, data):
+        # 只做一次拷贝，从不等待客户端
+        data = memoryview(data)
+        step = self.capacity >> 2
+        with self._cond:
+            if self._ring is None:
+                return
+            for i in range(0, len(data), step):
+                self._put(data[i:i+step])
+                if self._parsing:
+                    self._parse()
+            self._cond.notify_all()
+
+    def _put(self, data):
+        n = len(data)
+        start = self.writePos % self.capacity
+        first = min(n, self.capacity-start)
+        self._ring[start:start+first] = data[:first]
+        if first < n:
+            self._ring[:n-first] = data[first:]
+        self.writePos += n
+
+    def _read(self, pos, n):
+        # 从环中取出一小段数据的拷贝（仅用于解析tag头部）
+        start = pos % self.capacity
+        first = min(n, self.capacity-start)
+        data = bytes(self._ring[start:start+first])
+        if first < n:
+            data += bytes(self._ring[:n-first])
+        return data
+
+    def _parse(self):
+        # 增量解析flv tag，记录头部信息与关键帧位置
+        if self._nextTag == 0:
+            if self.writePos < 13:
+                return
+            head = self._read(0, 13)
+            if head[:3] != b'FLV':
+                logger.warning('live stream is not flv, keyframe alignment disabled')
+                self._parsing = False
+                return
+            self._headerParts.append(head)
+            self._nextTag = 13
+
+        while self.writePos >= self._nextTag + 13:
+            tag = self._read(self._nextTag, 13)
+            tagType = tag[0]
+            dataSize = int.from_bytes(tag[1:4], byteorder='big')
+            tagEnd = self._nextTag + 11 + dataSize + 4
+            if tagType not in (8, 9, 18):
+                logger.warning(f'unknown flv tag type {tagType}, keyframe alignment disabled')
+                self._parsing = False
+                return
+
+            isHeader = tagType == 18 or \
+                (tagType == 9 and tag[12] == 0) or \
+                (tagType == 8 and tag[11] >> 4 == 10 and tag[12] == 0)
+            if isHeader and self.header is None:
+                if self.writePos < tagEnd:
+                    return  # 等待完整的头部tag
+                self._headerParts.append(
+                    self._read(self._nextTag, tagEnd-self._nextTag))
+            elif tagType == 9 and tag[11] >> 4 == 1:
+                if self.header is None:
+                    self.header = b''.join(self._headerParts)
+                    self._headerParts = []
+                self.keyframePos = self._nextTag
+            self._nextTag = tagEnd
+
+    def _keyframeReady(self):
+        # 最近的关键帧仍在环中
+        return self.keyframePos is not None and \
+            self.writePos - self.keyframePos <= self.capacity
+
+    def open(self, timeout=10):
+        # 等待可以开始播放的位置，返回 (generation, 头部, 起始位置)；未在录制或超时返回None
+        with self._cond:
+            if self._ring is None:
+                return None
+            generation = self.generation
+            self._cond.wait_for(
+                lambda: self.generation != generation or self._keyframeReady() or
+                (not self._parsing and self.writePos > 0), timeout)
+            if self.generation != generation or self._ring is None:
+                return None
+            if self._keyframeReady():
+                return generation, self.header, self.keyframePos
+            if not self._parsing and self.writePos <= self.capacity:
+                # 无法识别tag时只能从头发送
+                return generation, b'', 0
+            return None
+
+    def serve(self, wfile, session, maxchunk=256 << 10):
+        # 向一个客户端发送数据：先发送头部与最近的关键帧，再发送实时数据
+        generation, header, pos = session
+        if header:
+            wfile.write(header)
+
+        while True:
+            with self._cond:
+                self._cond.wait_for(
+                    lambda: self.generation != generation or self.writePos > pos, 5)
+                if self.generation != generation:
+                    return
+                if self.writePos - pos > self.capacity:
+                    logger.info('live server: client too slow, disconnected')
+                    return
+                view = self._view
+                start = pos % self.capacity
+                n = min(self.writePos-pos, self.capacity-start, maxchunk)
+            if n:
+                wfile.write(view[start:start+n])
+                with self._cond:
+                    # 发送期间数据已被覆盖则客户端收到的数据不可信
+                    if self.generation != generation or self.writePos - pos > self.capacity:
+                        logger.info('live server: client too slow, disconnected')
+                        return
+                pos += n
+
+
+class _Handler(BaseHTTPRequestHandler):
+    timeout = 30
+
+    def do_GET(self):
+        name = self.path.split('?')[0].strip('/')
+        if name.endswith('.flv'):
+            name = name[:-4]
+        buf = self.server.buffers.get(name)
+        if buf is None:
+            self.send_error(404)
+            return
+        session = buf.open()
+        if session is None:
+            self.send_error(503, 'Room is not being recorded')
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'video/x-flv')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        self.close_connection = True
+        logger.info(f'live server: client {self.client_address[0]} connected to {name}')
+        try:
+            buf.serve(self.wfile, session)
+        except OSError:
+            pass
+        logger.info(f'live server: client {self.client_address[0]} left {name}')
+
+    def log_message(self, format, *args):
+        logger.debug('live server: ' + format % args)
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class LiveServer(threading.Thread):
+    # 将正在录制的直播流转发给本地的观看者，不额外连接CDN
+    servers = []
+
+    def __init__(self, address, rooms, buffersize=8 << 20):
+        super().__init__(daemon=True)
+        self.httpd = _Server(address, _Handler)
+        self.httpd.buffers = {}
+        for room in rooms:
+            room.streamBuffer = StreamBuffer(buffersize)
+            self.httpd.buffers[room.code] = room.streamBuffer
+            self.httpd.buffers[str(room.id)] = room.streamBuffer
+        self.servers.append(self)
+
+    def run(self):
+        host, port = self.httpd.server_address[:2]
+        logger.info(f'live server listening on http://{host}:{port}/<room>.flv')
+        self.httpd.serve_forever()
+
+    @classmethod
+    def onexit(cls):
+        for s in cls.servers:
+            for buf in s.httpd.buffers.values():
+                buf.close()
+            s.httpd.shutdown()
+            s.httpd.server_close()
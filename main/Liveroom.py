@@ -3,9 +3,14 @@ import requests
 import logging
 import os
 import re
+import random
+from urllib.parse import urlparse
 
 from .Recorder import Recorder
 from .FlvCheckThread import FlvCheckThread
+from .Admission import AdmissionController
+from .UrlRacer import UrlRacer
+from .Notifier import Notifier
 
 logger = logging.getLogger('monitor')
 
@@ -51,7 +56,7 @@ def _formatDuration(duration: float):
 class LiveRoom():
     overrideDynamicInterval = False
 
-    def __init__(self, roomid, code, savefolder, updateInterval=60, history=None, tmpfolder=None):
+    def __init__(self, roomid, code, savefolder, updateInterval=60, history=None, tmpfolder=None, priority=0):
 
         self.id = roomid
         self.code = code
@@ -59,11 +64,16 @@ class LiveRoom():
         self._tmpfolder = tmpfolder or savefolder
         self.history = history or [0]*144
         self._baseUpdateInterval = updateInterval
+        self.priority = priority
+        AdmissionController.register(self)
 
         self._roomInfo = {}
         self._username = None
         self.onair = False
         self.recordThread = None
+        self.streamBuffer = None  # 由LiveServer设置
+        self._badHosts = {}  # host -> 断流的时间
+        self._session = None  # 一次开播期间的 [录制时长, 文件大小]，断流重连不会重复推送通知
 
     @property
     def _headers(self):
@@ -98,7 +108,7 @@ class LiveRoom():
         }
         self.onair = self._roomInfo['live_status'] == 1
 
-    def _getLiveUrl(self):
+    def _getLiveUrls(self):
         # 获取推流链接
         if not self.onair:
             logger.info(f'{self.code} is not on air.')
@@ -112,7 +122,9 @@ class LiveRoom():
         ).json()['data']['quality_description']
         self._roomInfo['live_rates'] = {
             rate['qn']: rate['desc'] for rate in rates}
-        qn = max(self._roomInfo['live_rates'])
+        qn = AdmissionController.chooseQuality(self, self._roomInfo['live_rates'])
+        self._qn = qn
+        logger.info(f'{self.code}: quality {self._roomInfo["live_rates"][qn]}({qn}) selected.')
 
         # 推流链接
         response = requests.get(
@@ -120,8 +132,10 @@ class LiveRoom():
                 self._roomInfo['room_id'], qn),
             timeout=10, headers=self._headers
         ).json()
-        url = response['data']['durl'][0]['url']
-        return url
+        # 按节点的历史表现排序，近期断流过的节点排在最后
+        urls = UrlRacer.rank([item['url'] for item in response['data']['durl']])
+        now = time.time()
+        return sorted(urls, key=lambda url: now - self._badHosts.get(urlparse(url).hostname, 0) <= 600)
 
     def startRecording(self):
         if not self.onair:
@@ -129,7 +143,7 @@ class LiveRoom():
             return None
         if not self._username:
             self._getUserName()
-        url = self._getLiveUrl()
+        urls = self._getLiveUrls()
         if not os.path.isdir(self._tmpfolder):
             os.mkdir(self._tmpfolder)
         filename = '{room_id}-{username}-{time}-{endtime}-{title}'.format(
@@ -141,14 +155,19 @@ class LiveRoom():
 
         # 防止标题和用户名中含有windows路径的非法字符
         filename = re.sub(r'[\<\>\:\"\\\'\\\/\|\?\*\.]', '', filename)+'.flv'
-        self.notifyAtBeginning()
+        if self._session is None:
+            self._session = [0., 0]
+            self.notifyAtBeginning()
         self.recordThread = Recorder(
-            url=url,
+            url=urls[0],
+            candidates=urls,
             savepath=os.path.join(self._tmpfolder, filename),
             threadid=self.code,
-            room=self
+            room=self,
+            expectedBitrate=AdmissionController.bitrates.get((self.id, self._qn))
         )
         self.recordThread.start()
+        AdmissionController.admit(self, self._qn)
 
     def report(self) -> float:
         # 返回值为现在距下一次检查的时间
@@ -156,11 +175,24 @@ class LiveRoom():
             if self.recordThread.isRecording():
                 logger.info('{}: {} downloaded.'.format(
                     self.code, _dataunitConv(self.recordThread.downloaded)))
+                if Recorder.pool:
+                    logger.debug(f'{self.code}: buffer pool {Recorder.pool.stats()}')
+                AdmissionController.sample(self, self.recordThread.downloaded)
                 return 10  # report status after 10 sec
             else:
+                AdmissionController.release(self)
+                failed = self.recordThread.failed
+                if not failed:
+                    UrlRacer.recordSession(self.recordThread._url)
+                if failed:
+                    self._badHosts[urlparse(self.recordThread._url).hostname] = time.time()
+                    UrlRacer.penalize(self.recordThread._url)
                 del self.recordThread
                 self.recordThread = None
-                return 5 # 防止因网络问题导致断流
+                if failed:
+                    logger.info(f'{self.code}: switching to another stream url.')
+                    return 0
+                return 5 + random.random()*5 # 防止因网络问题导致断流，错开各房间的重连
         else:
             interval = self.updateInterval
             logger.info(
@@ -178,6 +210,7 @@ class LiveRoom():
                     self.startRecording()
                     return 10
                 else:
+                    self.endSession()
                     return interval
 
     @property
@@ -191,7 +224,17 @@ class LiveRoom():
                 t = _dividePeriod(time.time())
                 return 300*(self._baseUpdateInterval / 300)**(self.history[t]/max(self.history))
 
+    def endSession(self):
+        # 直播结束（或程序退出）时推送一次录制结束的通知
+        if self._session is not None:
+            duration, filesize = self._session
+            self._session = None
+            self.notifyAtEnd(duration, filesize)
+
     def recordingFinished(self, path, datasize, sttime, endtime):
+        if self._session is not None:
+            self._session[0] += endtime-sttime
+            self._session[1] += datasize
         if datasize < 65536:  # 64KB
             os.remove(path)  # 删除过小的文件
         else:
@@ -214,10 +257,8 @@ class LiveRoom():
 
             os.rename(path, temppath)
 
-            self.notifyAtEnd(endtime-sttime, datasize)
-
             logger.info(f'{self.code}: enqueue FlvCheck task.')
-            FlvCheckThread.addTask(temppath, saveto)
+            FlvCheckThread.addTask(temppath, saveto, self.priority)
             
 
     def notifyAtBeginning(self):
@@ -227,20 +268,10 @@ class LiveRoom():
         pass
 
     @classmethod
-    def setNotification(cls, barkurl):
-        def pushMessage(title, msg):
-            logger.info(
-                f"sending message to {barkurl}:\n title:{title} \n{msg}")
-            try:
-                req = requests.post(barkurl, data={
-                    "title": title,
-                    "body": msg,
-                    "group": "recorder"
-                })
-            except:
-                logger.warning("error occurred when sending message.")
-            else:
-                logger.info(f"received data: {req.text}")
+    def setNotification(cls, barkurl, **kwargs):
+        notifier = Notifier(barkurl, **kwargs)
+        notifier.start()
+        pushMessage = notifier.push
 
         def notifyAtBeginning(self):
             pushMessage("录播姬", startNotice.format(
@@ -4,18 +4,20 @@ import os
 import pickle
 from queue import PriorityQueue
 import threading
+import re
 
 from .FlvCheckThread import FlvCheckThread
+from .flv_checker import scanTail
 from .Recorder import Recorder
+from .LiveServer import LiveServer
+from .Notifier import Notifier
 
 logger = logging.getLogger('monitor')
 
 
 def createFlvcheckThreads(count=1, historypath=None):
-    # 创建时间戳校准进程
-    for _ in range(count):
-        a = FlvCheckThread()
-        a.start()
+    # 创建时间戳校准进程，count为每个目标磁盘同时处理的任务数
+    FlvCheckThread.setConcurrency(int(count))
 
     # 读取未完成的时间戳校准
     if historypath:
@@ -23,11 +25,56 @@ def createFlvcheckThreads(count=1, historypath=None):
         if os.path.isfile(queuepath):
             with open(queuepath, 'rb') as f:
                 unfinished = pickle.load(f)
-            for temppath, saveto in unfinished:
+            for temppath, saveto, *priority in unfinished:
                 if os.path.isfile(temppath):
                     logger.info(
                         f'Enqueue unfinished FlvCheck task:\n    {temppath} -> {saveto}')
-                    FlvCheckThread.addTask(temppath, saveto)
+                    FlvCheckThread.addTask(temppath, saveto, *priority)
+
+
+def recoverOrphans(tmpfolder, saveroot, savefolders=None):
+    # 处理程序异常退出时遗留在暂存目录中、文件名仍含{endtime}的录制
+    # savefolders: 房间id -> 保存目录，找不到对应房间时保存到saveroot
+    if not os.path.isdir(tmpfolder):
+        return
+    savefolders = savefolders or {}
+    pattern = re.compile(r'^(\d+)-.*-(\d{12})-\{endtime\}-.*\.flv$')
+    for filename in os.listdir(tmpfolder):
+        match = pattern.match(filename)
+        if not match:
+            continue
+        path = os.path.join(tmpfolder, filename)
+        try:
+            sttime = time.mktime(time.strptime(match.group(2), '%y%m%d%H%M%S'))
+            mtime = os.path.getmtime(path)
+            result = scanTail(path)
+            if result:
+                validLength, firstTimestamp, lastTimestamp = result
+                os.truncate(path, validLength)
+                # 时间戳可能被CDN重置或跳变，结束时间不晚于文件的修改时间
+                endtime = min(max(sttime, sttime + (lastTimestamp-firstTimestamp)/1000), mtime)
+            else:
+                validLength = os.path.getsize(path)
+                endtime = mtime
+            if validLength < 65536:  # 64KB
+                os.remove(path)
+                continue
+
+            savefolder = savefolders.get(int(match.group(1)), saveroot)
+            if not os.path.isdir(savefolder):
+                os.makedirs(savefolder)
+            newname = filename.replace(
+                '{endtime}', time.strftime('%H%M%S', time.localtime(endtime)))
+            temppath = os.path.join(tmpfolder, newname)
+            saveto = os.path.join(savefolder, newname)
+            if os.path.abspath(tmpfolder) == os.path.abspath(savefolder):
+                temppath = temppath[:-4]+".tmp.flv"
+            os.rename(path, temppath)
+            logger.info(
+                f'Enqueue orphaned recording:\n    {temppath} -> {saveto}')
+            FlvCheckThread.addTask(temppath, saveto)
+        except Exception:
+            logger.exception(f'failed to recover {filename}')
 
 
 class Monitor:
@@ -43,9 +90,11 @@ class Monitor:
     def run(self):
         logger.info('monitor thread running')
         q = PriorityQueue()
+        # 错开各房间的首次检查，避免同时请求
         t = time.time()+3
+        spacing = min(0.5, 10/len(self.rooms))
         for index in range(len(self.rooms)):
-            q.put((t, index))
+            q.put((t+index*spacing, index))
         logger.info('The process will begin after 3 seconds')
 
         while not self.event.is_set():
@@ -72,10 +121,14 @@ class Monitor:
         self.event.set()
         logger.info('Program terminating')
         Recorder.onexit()
+        for r in self.rooms:
+            r.endSession()
+        LiveServer.onexit()
         if self.cleanTerminate:
             logger.info('waiting for flvcheck thread')
             FlvCheckThread.q.join()
         FlvCheckThread.onexit()
+        Notifier.onexit()
 
         logger.info('Storing history')
         if self.historypath:
@@ -93,7 +146,7 @@ class Monitor:
             l = list(FlvCheckThread.getQueue())
             if l:
                 logger.info('Remaining FlvCheck tasks:\n' +
-                            '\n'.join((f"    {i} -> {j}" for i, j in l)))
+                            '\n'.join((f"    {i[0]} -> {i[1]}" for i in l)))
             with open(os.path.join(self.historypath, 'queue.pkl'), 'wb') as f:
                 pickle.dump(l, f)
             
@@ -0,0 +1,109 @@
+from collections import deque
+import threading
+import requests
+import logging
+import time
+
+logger = logging.getLogger('monitor')
+
+
+class Notifier(threading.Thread):
+    # 在后台线程中推送通知，短时间内的多条消息合并为一条发送
+    instances = []
+
+    def __init__(self, barkurl, timeout=10, retries=3, backlog=100, coalesce=5):
+        super().__init__(daemon=True)
+        self.barkurl = barkurl
+        self.timeout = timeout
+        self.retries = retries
+        self.coalesce = coalesce  # 收到消息后等待合并的时间（秒）
+        self._queue = deque(maxlen=backlog)
+        self._cond = threading.Condition()
+        self._stopping = False
+
+        self.sent = 0
+        self.failed = 0
+        self.dropped = 0
+        self.maxLatency = 0.
+        self._totalLatency = 0.
+        self.instances.append(self)
+
+    def push(self, title, msg):
+        # 不阻塞调用者，队列已满时丢弃最早的消息
+        with self._cond:
+            if len(self._queue) == self._queue.maxlen:
+                self.dropped += 1
+            self._queue.append((time.monotonic(), title, msg))
+            self._cond.notify()
+
+    def run(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._queue or self._stopping)
+                if not self._queue:
+                    return
+                if not self._stopping:
+                    self._cond.wait_for(lambda: self._stopping, self.coalesce)
+                batch = list(self._queue)
+                self._queue.clear()
+            self._deliver(batch)
+
+    def _deliver(self, batch):
+        title = batch[0][1]
+        if len(batch) == 1:
+            msg = batch[0][2]
+        else:
+            title = f'{title}（{len(batch)}条消息）'
+            msg = '\n\n'.join(item[2] for item in batch)
+        logger.info(
+            f"sending message to {self.barkurl}:\n title:{title} \n{msg}")
+
+        for attempt in range(self.retries+1):
+            try:
+                req = requests.post(self.barkurl, data={
+                    "title": title,
+                    "body": msg,
+                    "group": "recorder"
+                }, timeout=self.timeout)
+                req.raise_for_status()
+            except Exception as e:
+                logger.warning(f"error occurred when sending message: {e}")
+                if attempt < self.retries:
+                    with self._cond:
+                        if self._cond.wait_for(lambda: self._stopping, 2 ** attempt):
+                            break
+            else:
+                logger.info(f"received data: {req.text}")
+                now = time.monotonic()
+                with self._cond:
+                    self.sent += len(batch)
+                    for enqueued, *_ in batch:
+                        self._totalLatency += now - enqueued
+                        self.maxLatency = max(self.maxLatency, now - enqueued)
+                return
+        with self._cond:
+            self.failed += len(batch)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'queued': len(self._queue),
+                'sent': self.sent,
+                'failed': self.failed,
+                'dropped': self.dropped,
+                'avgLatency': self._totalLatency/self.sent if self.sent else 0.,
+                'maxLatency': self.maxLatency,
+            }
+
+    @classmethod
+    def onexit(cls, timeout=15):
+        for n in cls.instances:
+            n.stop(timeout)
+
+    def stop(self, timeout=None):
+        # 尽量发送完剩余的消息
+        with self._cond:
+            self._stopping = True
+            self._cond.notify_all()
+        self.join(timeout)
+        logger.info(f'notification stats: {self.stats()}')
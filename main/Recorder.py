@@ -2,23 +2,60 @@ import threading
 import requests
 import logging
 import time
+import os
+import socket
+
+from .IOScheduler import IOScheduler, getDevice
+from .UrlRacer import UrlRacer
 
 logger = logging.getLogger('recorder')
 
 
+class StallWatchdog:
+    # 按时间窗口统计下载速度，低于预期码率的一定比例即视为断流
+    # 由Recorder的计时线程每秒调用feed，不依赖数据块是否读完
+    def __init__(self, timeout=15, ratio=0.3, expected=None):
+        self.timeout = timeout
+        self.ratio = ratio
+        self.expected = expected  # bits/s，未知时使用本次录制此前的平均速度
+        self.start = self.windowStart = time.monotonic()
+        self.total = self.windowBytes = 0
+
+    def feed(self, nbytes):
+        # 返回True表示已断流
+        now = time.monotonic()
+        self.total += nbytes
+        self.windowBytes += nbytes
+        elapsed = now - self.windowStart
+        if elapsed < self.timeout:
+            return False
+        rate = self.windowBytes*8/elapsed
+        expected = self.expected
+        if not expected and self.windowStart > self.start:
+            expected = (self.total-self.windowBytes)*8/(self.windowStart-self.start)
+        self.windowStart, self.windowBytes = now, 0
+        return bool(expected) and rate < expected*self.ratio
+
+
 class Recorder(threading.Thread):
     runningThreads = {}
+    pool = None  # 设置后使用readinto读入共享的缓冲区
+    stallTimeout = 15
+    stallRatio = 0.3
 
-    def __init__(self, url, savepath, threadid, room):
+    def __init__(self, url, savepath, threadid, room, expectedBitrate=None, candidates=None):
         super().__init__()
         self.room = room
         self.roomid = room.id
         self._url = url
+        self._candidates = candidates or [url]
         self.threadid = threadid
         self.savepath = savepath
+        self._expectedBitrate = expectedBitrate
 
         self._downloading = False
         self.downloaded = 0
+        self.failed = False  # 因断流或网络错误结束，应立即换线路重连
 
     def run(self):
         logger.info(f'{self.threadid}: start recording thread')
@@ -27,6 +64,8 @@ class Recorder(threading.Thread):
             self._record()
         except Exception as e:
             logger.exception(f'{self.threadid}: exception occurred')
+            self.failed = True
+            self._downloading = False
         del Recorder.runningThreads[(self.roomid, self.savepath)]
         logger.info(f'{self.threadid}: recording thread terminated')
 
@@ -38,37 +77,114 @@ class Recorder(threading.Thread):
         for i in rt:
             i.join()
 
+    @classmethod
+    def setBufferPool(cls, pool):
+        cls.pool = pool
+
+    @classmethod
+    def setWatchdog(cls, timeout=15, ratio=0.3):
+        cls.stallTimeout = timeout
+        cls.stallRatio = ratio
+
+    def _iterContent(self, response, prefix=b''):
+        if prefix:
+            yield prefix
+        fp = getattr(response.raw, '_fp', None)
+        if not self.pool or fp is None or response.headers.get('Content-Encoding'):
+            yield from response.iter_content(chunk_size=65536)
+            return
+        # 直接从http.client读入池中的缓冲区，避免每个块都分配新的bytes
+        while self._downloading:
+            buf = self.pool.acquire(timeout=1)
+            if buf is None:
+                continue
+            try:
+                n = fp.readinto(buf)
+                if not n:
+                    return
+                yield memoryview(buf)[:n]
+            finally:
+                self.pool.release(buf)
+
+    def _watch(self, response, watchdog):
+        # 计时线程：定期检查下载速度，断流时中断阻塞中的读取
+        last = 0
+        while self._downloading:
+            time.sleep(1)
+            downloaded = self.downloaded
+            if self._downloading and watchdog.feed(downloaded-last):
+                logger.warning(f'{self.threadid}: stream stalled, reconnecting')
+                self.failed = True
+                self._downloading = False
+                self._abort(response)
+            last = downloaded
+
+    @staticmethod
+    def _abort(response):
+        sock = getattr(getattr(response.raw, '_connection', None), 'sock', None)
+        try:
+            if sock is not None:
+                sock.shutdown(socket.SHUT_RDWR)
+            else:
+                response.close()
+        except OSError:
+            pass
+
     def _record(self):
         self._downloading = True
 
+        buf = self.room.streamBuffer
+        device = getDevice(os.path.dirname(os.path.abspath(self.savepath)))
+
+        headers = {
+            'Accept': 'application/json, text/plain, */*',
+            'Accept-Encoding': 'gzip, deflate, br',
+            'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
+            'Origin': 'https://live.bilibili.com',
+            'Referer': f'https://live.bilibili.com/{self.roomid}',
+            'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:68.0) Gecko/20100101 Firefox/68.0',
+        }
         starttime = time.time()
-        with open(self.savepath, "wb") as file:
+        if UrlRacer.count > 1 and len(self._candidates) > 1:
+            response, prefix, self._url = UrlRacer.race(
+                self._candidates, headers, 10, self.stallTimeout)
+        else:
             response = requests.get(
-                self._url, stream=True,
-                headers={
-                    'Accept': 'application/json, text/plain, */*',
-                    'Accept-Encoding': 'gzip, deflate, br',
-                    'Accept-Language': 'zh-CN,zh;q=0.8,zh-TW;q=0.7,zh-HK;q=0.5,en-US;q=0.3,en;q=0.2',
-                    'Origin': 'https://live.bilibili.com',
-                    'Referer': f'https://live.bilibili.com/{self.roomid}',
-                    'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64; rv:68.0) Gecko/20100101 Firefox/68.0',
-                },
-                timeout=300)
+                self._url, stream=True, headers=headers,
+                timeout=(10, self.stallTimeout))
+            prefix = b''
+        with open(self.savepath, "wb") as file:
+            IOScheduler.recordingStarted(device)
+            if buf:
+                buf.reset()
+            watchdog = StallWatchdog(
+                self.stallTimeout, self.stallRatio, self._expectedBitrate)
+            threading.Thread(
+                target=self._watch, args=(response, watchdog), daemon=True).start()
             try:
-                for data in response.iter_content(chunk_size=1048576):
+                for data in self._iterContent(response, prefix):
                     if not self._downloading:
                         break
                     if data:
+                        t = time.perf_counter()
                         file.write(data)
+                        IOScheduler.recordWrite(
+                            device, len(data), time.perf_counter()-t)
                         self.downloaded += len(data)
+                        if buf:
+                            buf.write(data)
             except:
                 logger.exception(f'{self.threadid}: exception occurred.',exc_info=True)
+                self.failed = self.failed or self._downloading
             finally:
                 endtime = time.time()
                 logger.info(f'{self.threadid}: stop recording')
                 response.close()
                 self._downloading = False
-                
+                IOScheduler.recordingStopped(device)
+                if buf:
+                    buf.close()
+
                 self.room.recordingFinished(self.savepath,self.downloaded,starttime,endtime)
 
     def isRecording(self):
@@ -0,0 +1,126 @@
+import threading
+import time
+import os
+
+from .IOScheduler import getDevice
+
+
+class Task:
+    def __init__(self, temppath, saveto, priority=0):
+        self.temppath = temppath
+        self.saveto = saveto
+        self.priority = priority
+        self.device = getDevice(saveto)
+        self.size = os.path.getsize(temppath) if os.path.isfile(temppath) else 0
+        self.enqueued = time.monotonic()
+        self.started = None
+
+
+class TaskScheduler:
+    # 时间戳校准的任务队列：预计耗时短的任务优先，结合房间优先级与等待时间，
+    # 每个目标磁盘可以同时处理perDisk个任务
+    priorityWeight = 600  # 每级优先级相当于提前的秒数
+    agingRate = 0.5       # 每等待1秒相当于提前的秒数
+    defaultThroughput = 20 << 20  # bytes/s
+
+    def __init__(self, perDisk=1):
+        self.perDisk = perDisk
+        self._cond = threading.Condition()
+        self._pending = []
+        self._running = []
+        self._throughput = {}  # device -> 处理速度的滑动平均
+        self._unfinished = 0
+
+    def estimate(self, task):
+        return task.size / self._throughput.get(task.device, self.defaultThroughput)
+
+    def _score(self, task, now):
+        return self.estimate(task) - self.priorityWeight*task.priority \
+            - self.agingRate*(now-task.enqueued)
+
+    def _busy(self, device):
+        return sum(1 for t in self._running if t.device == device)
+
+    def put(self, temppath, saveto, priority=0):
+        task = Task(temppath, saveto, priority)
+        with self._cond:
+            self._pending.append(task)
+            self._unfinished += 1
+            self._cond.notify_all()
+        return task
+
+    def requeue(self, task):
+        # 被中断的任务重新排队，不计入新任务
+        with self._cond:
+            self._running.remove(task)
+            task.started = None
+            self._pending.append(task)
+            self._cond.notify_all()
+
+    def get(self, timeout=None):
+        # 返回所在磁盘仍有空闲的任务中得分最低的一个，超时返回None
+        with self._cond:
+            def ready():
+                return [t for t in self._pending if self._busy(t.device) < self.perDisk]
+            if not self._cond.wait_for(ready, timeout):
+                return None
+            now = time.monotonic()
+            task = min(ready(), key=lambda t: self._score(t, now))
+            self._pending.remove(task)
+            task.started = now
+            self._running.append(task)
+            return task
+
+    def task_done(self, task, success=True):
+        with self._cond:
+            self._running.remove(task)
+            elapsed = time.monotonic() - task.started
+            if success and task.size and elapsed > 1:
+                rate = task.size / elapsed
+                old = self._throughput.get(task.device)
+                self._throughput[task.device] = rate if old is None else old*0.7 + rate*0.3
+            self._unfinished -= 1
+            self._cond.notify_all()
+
+    def devices(self):
+        # 有待处理或正在处理任务的磁盘及其任务数
+        with self._cond:
+            count = {}
+            for t in self._pending + self._running:
+                count[t.device] = count.get(t.device, 0) + 1
+            return count
+
+    def eta(self):
+        # 按当前排序模拟各磁盘的处理过程，返回 [(temppath, 预计完成的剩余秒数)]
+        with self._cond:
+            now = time.monotonic()
+            slots = {}
+            result = []
+            for t in self._running:
+                remain = max(0., self.estimate(t) - (now - t.started))
+                slots.setdefault(t.device, []).append(remain)
+                result.append((t.temppath, remain))
+            for t in sorted(self._pending, key=lambda t: self._score(t, now)):
+                s = slots.setdefault(t.device, [])
+                if len(s) < self.perDisk:
+                    s.append(0.)
+                i = min(range(len(s)), key=s.__getitem__)
+                s[i] += self.estimate(t)
+                result.append((t.temppath, s[i]))
+            return result
+
+    def empty(self):
+        with self._cond:
+            return not self._pending
+
+    def join(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._unfinished == 0)
+
+    def drain(self):
+        # 取出所有未开始的任务
+        with self._cond:
+            pending, self._pending = self._pending, []
+            self._unfinished -= len(pending)
+            self._cond.notify_all()
+        return [(t.temppath, t.saveto, t.priority) for t in pending]
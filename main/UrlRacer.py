@@ -0,0 +1,194 @@
+from urllib.parse import urlparse
+import threading
+import requests
+import logging
+import time
+
+logger = logging.getLogger('recorder')
+
+
+class _HostStat:
+    def __init__(self):
+        self.ttfb = None        # 首字节时间（秒）
+        self.throughput = None  # 竞速时测得的初始下载速度（bytes/s）
+        self.successes = 0      # 未断流结束的录制次数
+        self.failures = 0
+
+    def score(self):
+        # 未知节点按中等水平处理，让它有机会被选中
+        ttfb = self.ttfb if self.ttfb is not None else 1.
+        throughput = self.throughput if self.throughput is not None else 1 << 20
+        reliability = (1 + self.successes) / (1 + self.successes + self.failures)
+        return throughput / (1 + ttfb) * reliability
+
+
+class _Candidate(threading.Thread):
+    def __init__(self, url, headers, connectTimeout, readTimeout, probeBytes, probeTime, cond):
+        super().__init__(daemon=True)
+        self.url = url
+        self.host = urlparse(url).hostname
+        self._headers = headers
+        self._timeout = (connectTimeout, readTimeout)
+        self._probeBytes = probeBytes
+        self._probeTime = probeTime
+        self._cond = cond  # 所有候选共享，首字节与结束时通知
+        self.response = None
+        self.prefix = []
+        self.ttfb = None
+        self.throughput = None
+        self.done = False
+        self.doneAt = None
+        self.cancelled = False
+
+    def run(self):
+        t0 = time.monotonic()
+        try:
+            self.response = requests.get(
+                self.url, stream=True, headers=self._headers, timeout=self._timeout)
+            self.response.raise_for_status()
+            fp = getattr(self.response.raw, '_fp', None)
+            if fp is not None and not self.response.headers.get('Content-Encoding'):
+                read = fp.read1
+            else:
+                # 与之后的iter_content一致，保存解码后的数据
+                def read(n):
+                    return self.response.raw.read(n, decode_content=True)
+            received = 0
+            while received < self._probeBytes and not self.cancelled:
+                data = read(65536)
+                if not data:
+                    break
+                now = time.monotonic()
+                if self.ttfb is None:
+                    first = now
+                    with self._cond:
+                        self.ttfb = now - t0
+                        self._cond.notify_all()
+                self.prefix.append(data)
+                received += len(data)
+                if now - first > self._probeTime:
+                    break
+            throughput = received / max(time.monotonic()-first, 1e-3) if received else None
+        except Exception as e:
+            logger.debug(f'url racing: {self.host} failed: {e}')
+            throughput = None
+        with self._cond:
+            self.throughput = throughput
+            self.doneAt = time.monotonic()
+            self.done = True
+            close = self.cancelled or throughput is None
+            self._cond.notify_all()
+        if close:
+            self.close()
+
+    def cancel(self):
+        # 已结束的候选在此关闭，否则由run结束时关闭，保证只处理一次
+        with self._cond:
+            self.cancelled = True
+            close = self.done
+        if close:
+            self.close()
+
+    def close(self):
+        if self.response is not None:
+            self.response.close()
+
+
+class UrlRacer:
+    # 同时连接多个推流节点，选择首字节最快、初始速度最高的一个
+    lock = threading.Lock()
+    hosts = {}
+    count = 0  # 参与竞速的链接数，小于2时不竞速
+    probeBytes = 256 << 10
+    probeTime = 2
+
+    @classmethod
+    def configure(cls, count=0, probeBytes=256 << 10, probeTime=2):
+        cls.count = count
+        cls.probeBytes = probeBytes
+        cls.probeTime = probeTime
+
+    @classmethod
+    def _host(cls, host):
+        stat = cls.hosts.get(host)
+        if stat is None:
+            stat = cls.hosts[host] = _HostStat()
+        return stat
+
+    @classmethod
+    def record(cls, url, ttfb=None, throughput=None):
+        with cls.lock:
+            stat = cls._host(urlparse(url).hostname)
+            if ttfb is not None:
+                stat.ttfb = ttfb if stat.ttfb is None else stat.ttfb*0.7 + ttfb*0.3
+            if throughput is not None:
+                stat.throughput = throughput if stat.throughput is None else \
+                    stat.throughput*0.7 + throughput*0.3
+                stat.failures = max(0, stat.failures-1)
+
+    @classmethod
+    def recordSession(cls, url):
+        # 录制正常结束（未断流），记录节点的稳定性
+        with cls.lock:
+            cls._host(urlparse(url).hostname).successes += 1
+
+    @classmethod
+    def penalize(cls, url):
+        with cls.lock:
+            cls._host(urlparse(url).hostname).failures += 1
+
+    @classmethod
+    def rank(cls, urls):
+        # 按历史表现排序（稳定排序，保持原有顺序作为次要依据）
+        with cls.lock:
+            return sorted(urls, key=lambda url: -cls._host(urlparse(url).hostname).score())
+
+    @classmethod
+    def race(cls, urls, headers, connectTimeout=10, readTimeout=15, grace=0.5):
+        # 返回 (response, 已读取的数据, url)，全部失败时抛出异常
+        # 第一个候选完成测速后再等待grace秒即选出结果，
+        # 且不晚于第一个候选收到首字节后的 probeTime+grace 秒
+        cond = threading.Condition()
+        candidates = [
+            _Candidate(url, headers, connectTimeout, readTimeout, cls.probeBytes, cls.probeTime, cond)
+            for url in urls[:max(cls.count, 1)]
+        ]
+        start = time.monotonic()
+        hardDeadline = start + connectTimeout + readTimeout + cls.probeTime
+        for c in candidates:
+            c.start()
+
+        with cond:
+            while not all(c.done for c in candidates):
+                now = time.monotonic()
+                finishes = [c.doneAt for c in candidates if c.done and c.throughput is not None]
+                ttfbs = [c.ttfb for c in candidates if c.ttfb is not None]
+                deadline = hardDeadline
+                if ttfbs:
+                    deadline = start + min(ttfbs) + cls.probeTime + grace
+                if finishes:
+                    deadline = min(deadline, min(finishes) + grace)
+                if now >= hardDeadline or now >= deadline and finishes:
+                    break
+                cond.wait((deadline if now < deadline else hardDeadline) - now)
+
+            # 在锁内一次性确定每个候选的结果
+            finished = [c for c in candidates if c.done and c.throughput is not None]
+            winner = max(finished, key=lambda c: c.throughput / (1 + c.ttfb)) if finished else None
+            outcomes = [(c, c.done, c.ttfb, c.throughput) for c in candidates]
+
+        for c, done, ttfb, throughput in outcomes:
+            if c is not winner:
+                c.cancel()
+            if throughput is not None:
+                cls.record(c.url, ttfb, throughput)
+            elif not done and ttfb is not None:
+                cls.record(c.url, ttfb)
+            else:
+                cls.penalize(c.url)
+        if winner is None:
+            raise ConnectionError('url racing: no candidate responded')
+
+        logger.info('url racing: {} selected (ttfb {:.3f}s, {:.0f} KB/s)'.format(
+            winner.host, winner.ttfb, winner.throughput/1024))
+        return winner.response, b''.join(winner.prefix), winner.url
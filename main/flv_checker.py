@@ -5,11 +5,13 @@ import struct
 
 class Flv(object):
 
-    def __init__(self, path, output, debug = False):
+    def __init__(self, path, output, debug = False, throttle = None):
         self.path = path
         self.debug = debug
         self.output = output
         self.keepRunning=True
+        # throttle(n): 每处理约1MB数据调用一次，用于限制读写速度
+        self.throttle = throttle
      
      
     def check(self):
@@ -32,6 +34,7 @@ class Flv(object):
         self.lastTimestampWrite = { b'\x08':-1, b'\x09':-1 }
         
         isFirstScriptTag = True
+        processed = 0
         remain = 10
         while self.keepRunning:# and remain >0:
             remain -=1
@@ -66,6 +69,10 @@ class Flv(object):
                 # 数据
                 data = origin.read(3 + dataSize)
                 dest.write(data)
+                processed += 15 + dataSize
+                if self.throttle and processed >= 1048576:
+                    self.throttle(processed)
+                    processed = 0
             elif tagType == b'\x12': # scripts
                 # 如果是scripts脚本，默认为第一个tag，此时将前一个tag Size 置零
                 dest.seek(dest.tell() - 4)
@@ -153,3 +160,98 @@ class Flv(object):
             else:
                 if self.debug:
                     print("没有找到duration标签")
+
+
+class _TailReader:
+    # 按固定大小的窗口从文件末尾向前读取，窗口外的少量数据直接从文件读取
+    def __init__(self, f, window):
+        self.f = f
+        self.window = window
+        self.start = self.end = 0
+        self.data = b''
+
+    def load(self, end):
+        self.start = max(end - self.window, 0)
+        self.end = end
+        self.f.seek(self.start)
+        self.data = self.f.read(end - self.start)
+
+    def read(self, pos, n):
+        if self.start <= pos and pos + n <= self.end:
+            return self.data[pos-self.start:pos-self.start+n]
+        self.f.seek(pos)
+        return self.f.read(n)
+
+
+def _tagAt(reader, pos, size):
+    # pos处是否为一个大小为size的完整audio/video/script tag，是则返回tag头部
+    if pos < 13 or size <= 11:
+        return None
+    head = reader.read(pos, 11)
+    if len(head) < 11 or head[0] not in (8, 9, 18) or head[8:11] != b'\x00\x00\x00' \
+            or int.from_bytes(head[1:4], byteorder='big') != size - 11:
+        return None
+    return head
+
+
+def _timestamp(head):
+    return int.from_bytes(head[4:7], byteorder='big') | (head[7] << 24)
+
+
+def scanTail(path, window=1048576, maxScan=64 << 20, maxTagSize=16 << 20):
+    # 从文件末尾向前查找最后一个完整的tag，用于恢复异常中断的录制
+    # 返回 (有效长度, 首个音视频tag的时间戳, 最后一个音视频tag的时间戳)，无法识别时返回None
+    filesize = os.path.getsize(path)
+    with open(path, "rb") as f:
+        head = f.read(min(filesize, window))
+        if len(head) < 13 or head[:3] != b'FLV':
+            return None
+
+        # 首个音视频tag的时间戳
+        firstTimestamp = None
+        pos = 13
+        while pos + 11 <= len(head):
+            size = 11 + int.from_bytes(head[pos+1:pos+4], byteorder='big')
+            if head[pos] not in (8, 9, 18):
+                break
+            if head[pos] != 18:
+                firstTimestamp = _timestamp(head[pos:pos+11])
+                break
+            pos += size + 4
+        if firstTimestamp is None:
+            return None
+
+        reader = _TailReader(f, window)
+        end = filesize
+        while end > 13 and filesize - end < maxScan:
+            reader.load(end)
+            data = reader.data
+            # 有效结尾前4字节为tag大小，不可能全为0，跳过末尾的0填充
+            top = min(len(data), len(data.rstrip(b'\x00')) + 3)
+            # q为候选的有效结尾（窗口内的相对位置），q-4处为最后一个tag的大小
+            for q in range(top, 3, -1):
+                size = int.from_bytes(data[q-4:q], byteorder='big')
+                if size <= 11 or size > maxTagSize:
+                    continue
+                validLength = reader.start + q
+                tag = validLength - 4 - size
+                last = _tagAt(reader, tag, size)
+                if last is None:
+                    continue
+                # 校验前一个tag，避免数据中的巧合
+                prev = int.from_bytes(reader.read(tag-4, 4), byteorder='big')
+                if tag != 13 and _tagAt(reader, tag-4-prev, prev) is None:
+                    continue
+                # 向前找到最后一个音视频tag
+                while last[0] == 18 and tag > 13:
+                    size = int.from_bytes(reader.read(tag-4, 4), byteorder='big')
+                    head = _tagAt(reader, tag-4-size, size)
+                    if head is None:
+                        break
+                    tag, last = tag-4-size, head
+                if last[0] == 18:
+                    return validLength, firstTimestamp, firstTimestamp
+                return validLength, firstTimestamp, _timestamp(last)
+            # 与上一个窗口重叠4字节，使跨越边界的tag大小也能被检查
+            end = reader.start + 4 if reader.start else 0
+        return None
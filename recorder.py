@@ -11,6 +11,8 @@ temppath=/data/tmp
 history=/data
 ; Bark App的推送地址，可以留空
 ; barkurl=https://api.day.app/<key>/
+; 本地转发正在录制的直播流的地址，留空则不启用，访问 http://<地址>/<房间标识符或房间id>.flv 观看
+; liveserver=0.0.0.0:8081
 
 ; 房间配置（可以有不止一个） 
 ; 例：
@@ -65,19 +67,24 @@ def setlogger(level=logging.INFO, filepath=None, filelevel=logging.WARNING):
 
 def cleartempDir(path):    # 完成剩余的时间轴处理任务后退出
     from configparser import ConfigParser
-    from main.Monitor import createFlvcheckThreads
+    from main.Monitor import createFlvcheckThreads, recoverOrphans
     from main.FlvCheckThread import FlvCheckThread
 
     config = ConfigParser()
     config.read(path)
 
+    TEMPDIR = os.getenv('TEMPDIR') or config['BASIC'].get('temppath', './tmp')
+    SAVEDIR = os.getenv('SAVEDIR') or config['BASIC'].get(
+        'saveroot', './downloads')
+
     HISTORYPATH = os.getenv(
         'HISTORYDIR') or config['BASIC'].get('history', './')
     if not os.path.isdir(HISTORYPATH):
         os.mkdir(HISTORYPATH)
 
-    createFlvcheckThreads(config['BASIC'].get(
+    createFlvcheckThreads(config['BASIC'].getint(
         'flecheckercount', 1), HISTORYPATH)
+    recoverOrphans(TEMPDIR, SAVEDIR, _savefolders(config, SAVEDIR))
     FlvCheckThread.q.join()
     FlvCheckThread.onexit()
 
@@ -86,10 +93,23 @@ def cleartempDir(path):    # 完成剩余的时间轴处理任务后退出
         pickle.dump(l, f)
 
 
+def _savefolders(config, saveroot):    # 房间id -> 保存目录，包括未启用的房间
+    return {
+        config[key].getint('roomid'): os.path.join(saveroot, key)
+        for key in config.sections()
+        if key != 'BASIC' and config[key].get('roomid')
+    }
+
+
 def runfromConfig(path):    # 从设置文件读取房间后运行
     from configparser import ConfigParser
     from main.Liveroom import LiveRoom
-    from main.Monitor import Monitor
+    from main.Monitor import Monitor, recoverOrphans
+    from main.IOScheduler import IOScheduler
+    from main.Admission import AdmissionController
+    from main.Recorder import Recorder
+    from main.BufferPool import BufferPool
+    from main.UrlRacer import UrlRacer
 
     config = ConfigParser()
     config.read(path)
@@ -110,9 +130,43 @@ def runfromConfig(path):    # 从设置文件读取房间后运行
         os.mkdir(HISTORYPATH)
     history = readHistory(HISTORYPATH)
 
+    # 录制进行中时时间戳校准的读写限制
+    IOScheduler.configure(
+        budget=config['BASIC'].get('iobudget', 8),
+        diskbudget=config['BASIC'].get('diskbudget', ''),
+        latency=config['BASIC'].get('iolatency', 0.2)
+    )
+
+    # 多个房间同时录制时的带宽分配
+    AdmissionController.configure(
+        bandwidth=config['BASIC'].get('bandwidth', 0)
+    )
+
+    # 断流检测
+    Recorder.setWatchdog(
+        timeout=config['BASIC'].getint('stalltimeout', 15),
+        ratio=config['BASIC'].getfloat('stallratio', 0.3)
+    )
+
+    # 同时连接多个推流节点并选择最快的一个
+    UrlRacer.configure(count=config['BASIC'].getint('urlracing', 0))
+
+    # 录制的接收缓冲区池
+    poolsize = config['BASIC'].getint('bufferpool', 0)
+    if poolsize:
+        Recorder.setBufferPool(BufferPool(
+            capacity=poolsize << 20,
+            buffersize=config['BASIC'].getint('poolbuffer', 64) << 10
+        ))
+
     barkurl = config['BASIC'].get('barkurl', '')
     if barkurl:
-        LiveRoom.setNotification(barkurl)
+        LiveRoom.setNotification(
+            barkurl,
+            timeout=config['BASIC'].getint('barktimeout', 10),
+            retries=config['BASIC'].getint('barkretries', 3),
+            coalesce=config['BASIC'].getint('barkcoalesce', 5)
+        )
 
     # 读取房间
     r = []
@@ -128,7 +182,8 @@ def runfromConfig(path):    # 从设置文件读取房间后运行
                 savefolder=os.path.join(SAVEDIR, key),
                 tmpfolder=TEMPDIR,
                 updateInterval=item.getint('updateinterval', 60),
-                history=history.get(roomid, None)
+                history=history.get(roomid, None),
+                priority=item.getint('priority', 0)
             ))
 
     if not r:
@@ -136,12 +191,23 @@ def runfromConfig(path):    # 从设置文件读取房间后运行
         logger.warning('program terminated')
         quit()
 
+    # 本地转发直播流
+    liveserver = config['BASIC'].get('liveserver', '')
+    if liveserver:
+        from main.LiveServer import LiveServer
+        host, _, port = liveserver.rpartition(':')
+        LiveServer(
+            (host or '127.0.0.1', int(port)), r,
+            buffersize=config['BASIC'].getint('liveserverbuffer', 8) << 20
+        ).start()
+
     # 运行
     monitor = Monitor(
         rooms=r,
-        flvcheckercount=config['BASIC'].get('flecheckercount', 1),
+        flvcheckercount=config['BASIC'].getint('flecheckercount', 1),
         historypath=HISTORYPATH
     )
+    recoverOrphans(TEMPDIR, SAVEDIR, _savefolders(config, SAVEDIR))
     for sig in [signal.SIGINT, signal.SIGHUP, signal.SIGTERM]:
         signal.signal(sig, monitor.shutdown)
     monitor.run()
@@ -149,7 +215,7 @@ def runfromConfig(path):    # 从设置文件读取房间后运行
 
 def runfromTerminalArgs(args):    # 从命令行参数读取房间后运行
     from main.Liveroom import LiveRoom
-    from main.Monitor import Monitor
+    from main.Monitor import Monitor, recoverOrphans
 
     if not os.path.isdir(args.savedir):
         logger.warning('provided savedir is not a folder')
@@ -162,6 +228,7 @@ def runfromTerminalArgs(args):    # 从命令行参数读取房间后运行
 
     # 运行
     monitor = Monitor(r, cleanTerminate=True)
+    recoverOrphans(SAVEDIR, SAVEDIR)
     for sig in [signal.SIGINT, signal.SIGHUP, signal.SIGTERM]:
         signal.signal(sig, monitor.shutdown)
     monitor.run()